@@ -1,56 +1,128 @@
 import pandas as pd
 import os
-import pypsa
 import numpy as np
+import matplotlib
+matplotlib.use("Agg")  # batch run: the plot is saved to a file, not shown
 import matplotlib.pyplot as plt
+from importlib.util import find_spec
 
-np.random.seed(42)
+MANDATORY_PRICE = 3880
+EPS = 1e-3
 
-# =========================================================
-# 1. LOAD DATA
-# =========================================================
-file_path = "Input_Exemplo.xlsx"
-base_name, ext = os.path.splitext(file_path)
-output_file = f"{base_name}_MarketResults{ext}"
-df = pd.read_excel(file_path)
+# "merit_order": closed-form bid-stack clearing (default)
+# "pypsa": one linear programme over all hours, solved with PyPSA + HiGHS
+CLEARING_METHOD = "merit_order"
 
-df.columns = df.columns.str.strip().str.upper()
-for c in ["TRANSACTION TYPE", "COUNTRY", "TECHNOLOGY", "UNIT", "AGENT"]:
-    if c in df.columns:
-        df[c] = df[c].astype(str).str.strip().str.upper()
+# Output of the per-bid trading results:
+# "excel": "Trading Results Detailed" sheet of the results workbook (default)
+# "parquet": <input>_TradingResults.parquet, much faster to write (needs pyarrow)
+TRADING_RESULTS_FORMAT = "excel"
 
-# Alias price + tie-breaker
-df["BID PRICE (EUR/MWH)"] = df["BID PRICE RANDOM LNEG 2 (EUR/MWH)"]
-df["BID PRICE (EUR/MWH)"] += 0.001 * np.random.rand(len(df))
+SOLVER_NAME = "highs"
+SOLVER_OPTIONS = {"presolve": "on", "parallel": "on"}
 
-# =========================================================
-# 2. HOURS TO SIMULATE
-# =========================================================
-cols_time = ["PERIOD OF YEAR", "YEAR", "MONTH", "DAY", "SESSION", "PERIOD"]
-hours = (
-    df[cols_time]
-    .dropna(subset=["PERIOD"])
-    .drop_duplicates(subset=["PERIOD"])
-    .sort_values("PERIOD")
-    .reset_index(drop=True)
-)
-hours[cols_time] = hours[cols_time].apply(pd.to_numeric, errors="coerce").astype(int)
+# Role of each PyPSA generator slot, stored in n.generators["role"]
+SELL_ROLE = 0
+FLEX_ROLE = 1
+
+# Optional fast I/O: Rust-based Excel parser and Parquet input cache
+EXCEL_ENGINE = "calamine" if find_spec("python_calamine") else None
+HAS_PYARROW = find_spec("pyarrow") is not None
+
+# Bump when the normalization in read_bids changes, to invalidate cached inputs
+INPUT_CACHE_VERSION = 1
+
+# Numeric session results, in the order returned by clear_hour
+SESSION_COLUMNS = [
+    "Price_PT (EUR/MWh)",
+    "Price_ES (EUR/MWh)",
+    "Congested",
+    "PT→ES Flow (MW)",
+    "ES→PT Flow (MW)",
+    "Total Supply (MWh)",
+    "Total Demand (MWh)"
+]
 
 # =========================================================
-# 3. RESULT CONTAINERS
+# MERIT-ORDER CLEARING
 # =========================================================
-session_results = []
-trading_results = []
+def _merit_order(prices, energies, demand):
+    """Clear one price stack against an inelastic demand.
+
+    Returns the marginal price and the energy accepted from each bid
+    (in input order). An empty stack has no price (NaN).
+    """
+    if len(prices) == 0:
+        return np.nan, np.zeros(0)
+
+    order = np.argsort(prices, kind="mergesort")
+    e = energies[order]
+    cum = np.cumsum(e)
+    # A relative float tolerance keeps cumsum rounding from making the next
+    # bid marginal; it is far below the 0.001 MWh resolution of the bids
+    k = min(np.searchsorted(cum, demand - 1e-9 * max(demand, 1.0)), len(cum) - 1)
+
+    accepted = np.empty_like(e)
+    accepted[order] = np.minimum(np.maximum(demand - (cum - e), 0.0), e)
+    return prices[order[k]], accepted
+
+
+def clear_two_zone(p_sell_pt, e_sell_pt, p_sell_es, e_sell_es,
+                   p_buy_pt, e_buy_pt, p_buy_es, e_buy_es, intercap):
+    """Closed-form clearing of the PT/ES market with one interconnector.
+
+    Bids are given as float64 price (p_*) and energy (e_*) arrays. Buy
+    bids enter the price stack as offers to give their energy back at
+    their bid price, against an inelastic demand equal to the total buy
+    energy, so one sort + cumsum clears both sides of a zone. Mandatory
+    buys (bid at MANDATORY_PRICE or above) are fixed demand, as in the
+    PyPSA model: they enter the stack at an infinite price, so they are
+    only given back, with an infinite zone price, when supply cannot
+    cover them. Both zones are first cleared as a single market; if the
+    resulting PT→ES flow exceeds intercap, the flow is fixed at the
+    limit and each zone is cleared on its own.
+
+    Returns (price_pt, price_es, flow, dispatch): flow is PT→ES (MW) and
+    dispatch holds the traded energy of sell_pt, sell_es, buy_pt, buy_es.
+    """
+    n_pt, n_es = len(p_sell_pt), len(p_sell_es)
+    p_buy_pt = np.where(p_buy_pt >= MANDATORY_PRICE, np.inf, p_buy_pt)
+    p_buy_es = np.where(p_buy_es >= MANDATORY_PRICE, np.inf, p_buy_es)
+    p_pt = np.concatenate((p_sell_pt, p_buy_pt))
+    e_pt = np.concatenate((e_sell_pt, e_buy_pt))
+    p_es = np.concatenate((p_sell_es, p_buy_es))
+    e_es = np.concatenate((e_sell_es, e_buy_es))
+    demand_pt = e_pt[n_pt:].sum()
+    demand_es = e_es[n_es:].sum()
+
+    price, accepted = _merit_order(
+        np.concatenate((p_pt, p_es)), np.concatenate((e_pt, e_es)), demand_pt + demand_es
+    )
+    accepted_pt, accepted_es = accepted[:len(p_pt)], accepted[len(p_pt):]
+    price_pt = price_es = price
+    flow = accepted_pt.sum() - demand_pt
+
+    if abs(flow) > intercap:
+        flow = np.copysign(intercap, flow)
+        price_pt, accepted_pt = _merit_order(p_pt, e_pt, demand_pt + flow)
+        price_es, accepted_es = _merit_order(p_es, e_es, demand_es - flow)
+
+    dispatch = (
+        accepted_pt[:n_pt],
+        accepted_es[:n_es],
+        e_pt[n_pt:] - accepted_pt[n_pt:],
+        e_es[n_es:] - accepted_es[n_es:],
+    )
+    return price_pt, price_es, flow, dispatch
 
-MANDATORY_PRICE = 3880
-EPS = 1e-3
 
 # =========================================================
-# 4. HOURLY MARKET CLEARING
+# HOURLY MARKET CLEARING
 # =========================================================
-for _, h in hours.iterrows():
-
+def _print_hour(h, session, intercap):
+    """Print the log of a cleared hour (session in SESSION_COLUMNS order)."""
     period = h["PERIOD"]
+    price_pt, price_es, congested, flow_pt_es, flow_es_pt = session[:5]
 
     print(
         f"\n===== SIMULATION HOUR {period} =====\n"
@@ -58,215 +130,498 @@ for _, h in hours.iterrows():
         f"Date: {h['YEAR']}-{h['MONTH']:02d}-{h['DAY']:02d}\n"
         f"SESSION: {h['SESSION']} | PERIOD: {period}\n"
     )
+    print(
+        f">>> Prices | PT: {price_pt:.4f} EUR/MWh | ES: {price_es:.4f} EUR/MWh | "
+        f"Congested: {'YES' if congested else 'NO'}"
+    )
+    print(
+        f">>> Interconnection | Capacity: {intercap:.0f} MW | "
+        f"PT→ES: {flow_pt_es:.2f} MW | ES→PT: {flow_es_pt:.2f} MW"
+    )
+
+
+def _intercap(df_h):
+    return float(df_h.get("INTERCONNECTION", pd.Series([3800])).iloc[0])
+
+
+def clear_hour(h, df_h):
+    """Clear the market for a single hour with the merit-order kernel.
+
+    h    : dict with the time columns of the hour (PERIOD, YEAR, ...)
+    df_h : bids of that hour
+
+    Returns the session results of the hour (in SESSION_COLUMNS order)
+    and, for each bid of df_h, its traded energy and clearing price.
+    """
+    intercap = _intercap(df_h)
+
+    # -------------------------------
+    # Split (pt_sell, es_sell, pt_buy, es_buy)
+    # -------------------------------
+    is_pt = df_h["IS PT"].to_numpy()
+    is_es = df_h["IS ES"].to_numpy()
+    is_sell = df_h["IS SELL"].to_numpy()
+    is_buy = df_h["IS BUY"].to_numpy()
+    bid_price = df_h["BID PRICE (EUR/MWH)"].to_numpy(np.float64)
+    bid_energy = df_h["BID ENERGY (MWH)"].to_numpy(np.float64)
+
+    valid = bid_energy > 0
+    splits = [
+        valid & is_pt & is_sell,
+        valid & is_es & is_sell,
+        valid & is_pt & is_buy,
+        valid & is_es & is_buy,
+    ]
+
+    # -------------------------------
+    # Solve
+    # -------------------------------
+    arrays = [a[m] for m in splits for a in (bid_price, bid_energy)]
+    price_pt, price_es, link_flow, dispatch = clear_two_zone(*arrays, intercap)
+    if np.isinf(price_pt) or np.isinf(price_es):
+        raise ValueError(f"Hour {h['PERIOD']}: supply cannot cover the mandatory demand")
+
+    q = np.zeros(len(df_h))
+    for m, accepted in zip(splits, dispatch):
+        q[m] = accepted
+
+    # -------------------------------
+    # Quantities
+    # -------------------------------
+    total_supply = q[is_sell].sum()
+    total_demand = q[is_buy].sum()
+
+    session = _session_values(
+        intercap, price_pt, price_es, link_flow, total_supply, total_demand
+    )
+
+    market_price = np.where(is_pt, price_pt, price_es)
+
+    return session, q, market_price
+
+
+def _session_values(intercap, price_pt, price_es, link_flow, total_supply, total_demand):
+
+    congested = abs(abs(link_flow) - intercap) < EPS
+
+    return (
+        price_pt,
+        price_es,
+        congested,
+        max(link_flow, 0),
+        max(-link_flow, 0),
+        total_supply,
+        total_demand
+    )
+
+
+def _trading_results(bids, times, traded, market_price):
+    """Trading results table, one row per bid (times: the hour of each bid)."""
+    return pd.DataFrame({
+        "PERIOD OF YEAR": times["PERIOD OF YEAR"].to_numpy(),
+        "YEAR": times["YEAR"].to_numpy(),
+        "MONTH": times["MONTH"].to_numpy(),
+        "DAY": times["DAY"].to_numpy(),
+        "SESSION": times["SESSION"].to_numpy(),
+        "PERIOD": times["PERIOD"].to_numpy(),
+        "Bidding Area": "MI",
+        "Agent": bids.get("AGENT", ""),
+        "Unit": bids.get("UNIT", ""),
+        "Country": bids["COUNTRY"],
+        "Technology": bids.get("TECHNOLOGY", ""),
+        "Capacity (MW)": bids["BID ENERGY (MWH)"],
+        "Transaction Type": bids["TRANSACTION TYPE"],
+        "Bid Price (EUR/MWh)": bids["BID PRICE (EUR/MWH)"],
+        "Bid Energy (MWh)": bids["BID ENERGY (MWH)"],
+        "Was Traded": (traded > 1e-6).astype(int),
+        "Clearing Price (EUR/MWh)": market_price,
+        "Traded Energy (MWh)": traded
+    })
+
+
+def _add_welfare(session_df, trading_df):
+    """Add the welfare and congestion rent of each hour to session_df.
+
+    Computed once for all hours from the trading results, with df.eval
+    (numexpr when installed) rather than inside the hourly clearing.
+    """
+    bid_price = trading_df["Bid Price (EUR/MWh)"].to_numpy(np.float64)
+    is_sell = (trading_df["Transaction Type"] == "SELL").to_numpy()
+    is_flex = (trading_df["Transaction Type"] == "BUY").to_numpy() & (bid_price < MANDATORY_PRICE)
+
+    bids = pd.DataFrame({
+        "period": trading_df["PERIOD"].to_numpy(),
+        "q": trading_df["Traded Energy (MWh)"].to_numpy(),
+        "bid_price": bid_price,
+        "market_price": trading_df["Clearing Price (EUR/MWh)"].to_numpy(),
+        "sell": is_sell.astype(np.float64),
+        "flex": is_flex.astype(np.float64)
+    })
+    surplus = bids.eval(
+        "producer = (market_price - bid_price) * q * sell\n"
+        "consumer = (bid_price - market_price) * q * flex"
+    ).groupby("period")[["producer", "consumer"]].sum()
+    surplus = surplus.reindex(session_df["PERIOD"].to_numpy(), fill_value=0.0)
+
+    session_df["Producer Surplus (€)"] = surplus["producer"].to_numpy()
+    session_df["Consumer Surplus (€)"] = surplus["consumer"].to_numpy()
+    session_df["Total Welfare (€)"] = session_df.eval(
+        "`Producer Surplus (€)` + `Consumer Surplus (€)`"
+    )
+    session_df["Congestion Rent (€)"] = session_df.eval(
+        "(`PT→ES Flow (MW)` + `ES→PT Flow (MW)`) * abs(`Price_PT (EUR/MWh)` - `Price_ES (EUR/MWh)`)"
+    )
+
+
+def _slot_names(role, bids, snapshot):
+    """Component names <ROLE>_<COUNTRY>_<k>, k numbering the bids of each
+    role and country within an hour (snapshot: the hour of each bid).
+
+    Slots are shared by all hours, so the network has as many components
+    of a kind as the busiest hour has bids of that kind.
+    """
+    country = bids["COUNTRY"].astype(str)
+    k = bids.groupby([snapshot, role, country]).cumcount()
+    return (role + "_" + country + "_" + k.astype(str)).to_numpy()
+
+
+def _slot_series(slots, value, snapshots):
+    """Time series of value for each slot, 0 in the hours a slot is unused."""
+    return (
+        slots.pivot(index="snapshot", columns="name", values=value)
+        .reindex(snapshots)
+        .fillna(0.0)
+    )
+
+
+def _slot_buses(slots, names):
+    """Bus of each slot in names."""
+    return slots.drop_duplicates("name").set_index("name")["bus"].reindex(names).to_numpy()
+
 
-    df_h = df[df["PERIOD"] == period].copy()
+def clear_day_pypsa(hours, df_by_period):
+    """Clear all hours as a single PyPSA linear programme, one snapshot per hour.
 
-    pt_sell = df_h[(df_h.COUNTRY == "PT") & (df_h["TRANSACTION TYPE"] == "SELL")]
-    es_sell = df_h[(df_h.COUNTRY == "ES") & (df_h["TRANSACTION TYPE"] == "SELL")]
-    pt_buy  = df_h[(df_h.COUNTRY == "PT") & (df_h["TRANSACTION TYPE"] == "BUY")]
-    es_buy  = df_h[(df_h.COUNTRY == "ES") & (df_h["TRANSACTION TYPE"] == "BUY")]
+    Hours share no constraint, so the programme splits into independent
+    blocks that HiGHS solves in one call. Returns, for each hour of hours,
+    the same (session, traded, market_price) results as clear_hour.
+    """
+    import pypsa  # only needed here: the merit-order path never loads it
+
+    records = hours.to_dict("records")
+    snapshots = pd.RangeIndex(len(records))
+    per_hour = [df_by_period[h["PERIOD"]] for h in records]
+
+    bids = pd.concat(per_hour)
+    sizes = [len(df_h) for df_h in per_hour]
+    snapshot = np.repeat(snapshots.to_numpy(), sizes)
+    intercap = np.array([_intercap(df_h) for df_h in per_hour])
+
+    bid_price = bids["BID PRICE (EUR/MWH)"].to_numpy(np.float64)
+    bid_energy = bids["BID ENERGY (MWH)"].to_numpy(np.float64)
+    valid = bid_energy > 0
+    is_sell = valid & bids["IS SELL"].to_numpy()
+    is_buy = valid & bids["IS BUY"].to_numpy()
+    is_mandatory = is_buy & (bid_price >= MANDATORY_PRICE)
+    is_flex = is_buy & ~is_mandatory
+
+    role = np.select([is_sell, is_mandatory, is_flex], ["SELL", "BUY", "FLEX"], "")
+    names = _slot_names(pd.Series(role, index=bids.index), bids, snapshot)
+
+    slots = pd.DataFrame({
+        "snapshot": snapshot,
+        "name": names,
+        "bus": bids["COUNTRY"].astype(str).to_numpy(),
+        "price": bid_price,
+        "energy": bid_energy
+    })
 
     # -------------------------------
     # Network
     # -------------------------------
+    # Components have a p_nom of 1 MW, so their per-unit time series carry
+    # the bid energy (or interconnection capacity) of each hour directly
     n = pypsa.Network()
-    n.set_snapshots([0])
+    n.set_snapshots(snapshots)
     n.add("Carrier", "electricity")
     n.add("Bus", "PT", carrier="electricity")
     n.add("Bus", "ES", carrier="electricity")
 
-    intercap = float(df_h.get("INTERCONNECTION", pd.Series([3800])).iloc[0])
     n.add(
         "Link",
         "PT_ES",
         bus0="PT",
         bus1="ES",
-        p_nom=intercap,
-        p_min_pu=-1,
+        p_nom=1.0,
+        p_max_pu=pd.Series(intercap, index=snapshots),
+        p_min_pu=pd.Series(-intercap, index=snapshots),
         efficiency=1.0
     )
 
     # -------------------------------
     # SELL bids
     # -------------------------------
-    for i, r in pd.concat([pt_sell, es_sell]).iterrows():
-        e = float(r["BID ENERGY (MWH)"])
-        if e <= 0:
-            continue
-        n.add(
-            "Generator",
-            f"SELL_{r['COUNTRY']}_{i}",
-            bus=r["COUNTRY"],
-            p_nom=e,
-            marginal_cost=float(r["BID PRICE (EUR/MWH)"])
-        )
+    sell = slots[is_sell]
+    energy = _slot_series(sell, "energy", snapshots)
+    n.add(
+        "Generator",
+        energy.columns,
+        bus=_slot_buses(sell, energy.columns),
+        p_nom=1.0,
+        p_max_pu=energy,
+        marginal_cost=_slot_series(sell, "price", snapshots),
+        role=SELL_ROLE
+    )
 
     # -------------------------------
     # BUY bids
     # -------------------------------
-    for i, r in pd.concat([pt_buy, es_buy]).iterrows():
-        e = float(r["BID ENERGY (MWH)"])
-        p = float(r["BID PRICE (EUR/MWH)"])
-        if e <= 0:
-            continue
-        if p >= MANDATORY_PRICE:
-            n.add("Load", f"BUY_{r['COUNTRY']}_{i}", bus=r["COUNTRY"], p_set=e)
-        else:
-            n.add(
-                "Generator",
-                f"FLEX_{r['COUNTRY']}_{i}",
-                bus=r["COUNTRY"],
-                p_nom=e,
-                p_min_pu=-1,
-                p_max_pu=0,
-                marginal_cost=p
-            )
+    load = slots[is_mandatory]
+    energy = _slot_series(load, "energy", snapshots)
+    n.add("Load", energy.columns, bus=_slot_buses(load, energy.columns), p_set=energy)
+
+    flex = slots[is_flex]
+    energy = _slot_series(flex, "energy", snapshots)
+    n.add(
+        "Generator",
+        energy.columns,
+        bus=_slot_buses(flex, energy.columns),
+        p_nom=1.0,
+        p_min_pu=-energy,
+        p_max_pu=0,
+        marginal_cost=_slot_series(flex, "price", snapshots),
+        role=FLEX_ROLE
+    )
 
     # -------------------------------
     # Solve
     # -------------------------------
-    n.optimize(solver_name="glpk")
+    status, condition = n.optimize(solver_name=SOLVER_NAME, solver_options=SOLVER_OPTIONS)
+    if status != "ok":
+        raise ValueError(
+            f"PyPSA clearing failed ({condition}): supply may not cover the mandatory demand"
+        )
 
-    price_pt = n.buses_t.marginal_price.loc[0, "PT"]
-    price_es = n.buses_t.marginal_price.loc[0, "ES"]
+    price_pt = n.buses_t.marginal_price["PT"].to_numpy()
+    price_es = n.buses_t.marginal_price["ES"].to_numpy()
 
-    link_flow = n.links_t.p0.loc[0, "PT_ES"]
-    congested = abs(abs(link_flow) - intercap) < EPS
-
-    print(
-        f">>> Prices | PT: {price_pt:.4f} EUR/MWh | ES: {price_es:.4f} EUR/MWh | "
-        f"Congested: {'YES' if congested else 'NO'}"
-    )
-    print(
-        f">>> Interconnection | Capacity: {intercap:.0f} MW | "
-        f"PT→ES: {max(link_flow,0):.2f} MW | ES→PT: {max(-link_flow,0):.2f} MW"
-    )
+    link_flow = n.links_t.p0["PT_ES"].to_numpy()
 
     # -------------------------------
-    # Quantities
+    # Quantities (one row per hour)
     # -------------------------------
-    sell_mask = n.generators.index.str.startswith("SELL")
-    flex_mask = n.generators.index.str.startswith("FLEX")
+    gen_p = n.generators_t.p.reindex(columns=n.generators.index, fill_value=0.0)
+    load_p = n.loads_t.p.reindex(columns=n.loads.index, fill_value=0.0)
+    q = gen_p.to_numpy()
 
-    total_supply = n.generators_t.p.loc[0, sell_mask].sum()
-    total_flex_demand = -n.generators_t.p.loc[0, flex_mask].sum()
-    total_mandatory_demand = n.loads_t.p.loc[0].sum()
+    gen_role = n.generators["role"].to_numpy()
+    sell_mask = gen_role == SELL_ROLE
+    flex_mask = gen_role == FLEX_ROLE
+
+    total_supply = q[:, sell_mask].sum(axis=1)
+    total_flex_demand = -q[:, flex_mask].sum(axis=1)
+    total_mandatory_demand = load_p.to_numpy().sum(axis=1)
     total_demand = total_flex_demand + total_mandatory_demand
 
     # -------------------------------
-    # Welfare
+    # Trading Results Detailed
     # -------------------------------
-    producer_surplus = 0.0
-    consumer_surplus = 0.0
+    gen_col = gen_p.columns.get_indexer(names)
+    load_col = load_p.columns.get_indexer(names)
 
-    for g in n.generators.index:
-        q = n.generators_t.p.loc[0, g]
-        if abs(q) < 1e-9:
-            continue
-        bid = n.generators.loc[g, "marginal_cost"]
-        zone = n.generators.loc[g, "bus"]
-        market_price = price_pt if zone == "PT" else price_es
+    traded = np.zeros(len(bids))
+    traded[is_sell] = q[snapshot[is_sell], gen_col[is_sell]]
+    traded[is_flex] = -q[snapshot[is_flex], gen_col[is_flex]]
+    traded[is_mandatory] = load_p.to_numpy()[snapshot[is_mandatory], load_col[is_mandatory]]
 
-        if g.startswith("SELL") and q > 0:
-            producer_surplus += (market_price - bid) * q
-        if g.startswith("FLEX") and q < 0:
-            consumer_surplus += (bid - market_price) * (-q)
-
-    total_welfare = producer_surplus + consumer_surplus
-    congestion_rent = abs(link_flow) * abs(price_pt - price_es)
+    market_price = np.where(bids["IS PT"].to_numpy(), price_pt[snapshot], price_es[snapshot])
 
     # -------------------------------
-    # Session results
+    # Per-hour results
     # -------------------------------
-    session_results.append({
-        **h.to_dict(),
-        "Bidding Area": "MI",
-        "Price_PT (EUR/MWh)": price_pt,
-        "Price_ES (EUR/MWh)": price_es,
-        "Congested": int(congested),
-        "PT→ES Flow (MW)": max(link_flow, 0),
-        "ES→PT Flow (MW)": max(-link_flow, 0),
-        "Total Supply (MWh)": total_supply,
-        "Total Demand (MWh)": total_demand,
-        "Producer Surplus (€)": producer_surplus,
-        "Consumer Surplus (€)": consumer_surplus,
-        "Total Welfare (€)": total_welfare,
-        "Congestion Rent (€)": congestion_rent
-    })
-
-    # -------------------------------
-    # Trading Results Detailed
-    # -------------------------------
-    for i, r in df_h.iterrows():
-
-        traded_energy = 0.0
-        was_traded = 0
-
-        if r["TRANSACTION TYPE"] == "SELL":
-            name = f"SELL_{r['COUNTRY']}_{i}"
-            if name in n.generators.index:
-                traded_energy = n.generators_t.p.loc[0, name]
-                was_traded = int(traded_energy > 1e-6)
-
-        elif r["TRANSACTION TYPE"] == "BUY":
-            if r["BID PRICE (EUR/MWH)"] >= MANDATORY_PRICE:
-                name = f"BUY_{r['COUNTRY']}_{i}"
-                if name in n.loads.index:
-                    traded_energy = n.loads_t.p.loc[0, name]
-                    was_traded = int(traded_energy > 1e-6)
-            else:
-                name = f"FLEX_{r['COUNTRY']}_{i}"
-                if name in n.generators.index:
-                    traded_energy = -n.generators_t.p.loc[0, name]
-                    was_traded = int(traded_energy > 1e-6)
-
-        clearing_price_unit = price_pt if r["COUNTRY"] == "PT" else price_es
-
-        trading_results.append({
-            "PERIOD OF YEAR": h["PERIOD OF YEAR"],
-            "YEAR": h["YEAR"],
-            "MONTH": h["MONTH"],
-            "DAY": h["DAY"],
-            "SESSION": h["SESSION"],
-            "PERIOD": h["PERIOD"],
-            "Bidding Area": "MI",
-            "Agent": r.get("AGENT", ""),
-            "Unit": r.get("UNIT", ""),
-            "Country": r["COUNTRY"],
-            "Technology": r.get("TECHNOLOGY", ""),
-            "Capacity (MW)": r["BID ENERGY (MWH)"],
-            "Transaction Type": r["TRANSACTION TYPE"],
-            "Bid Price (EUR/MWh)": r["BID PRICE (EUR/MWH)"],
-            "Bid Energy (MWh)": r["BID ENERGY (MWH)"],
-            "Was Traded": was_traded,
-            "Clearing Price (EUR/MWh)": clearing_price_unit,
-            "Traded Energy (MWh)": traded_energy
-        })
-
-# =========================================================
-# 5. EXPORT RESULTS
-# =========================================================
-
-session_df = pd.DataFrame(session_results)
-trading_df = pd.DataFrame(trading_results)
+    # Bids are stacked hour after hour: split the per-bid arrays at the
+    # hour boundaries instead of masking them once per hour
+    bounds = np.cumsum(sizes)[:-1]
+    traded = np.split(traded, bounds)
+    market_price = np.split(market_price, bounds)
+
+    results = []
+    for t in range(len(records)):
+        session = _session_values(
+            intercap[t], price_pt[t], price_es[t], link_flow[t], total_supply[t], total_demand[t]
+        )
+        results.append((session, traded[t], market_price[t]))
 
-with pd.ExcelWriter(output_file, engine="xlsxwriter") as writer:
-    session_df.to_excel(writer, sheet_name="Session Results", index=False)
-    trading_df.to_excel(writer, sheet_name="Trading Results Detailed", index=False)
+    return results
 
-print("\n✔ 24h Day-Ahead MIBEL Simulation Completed Successfully!")
 
 # =========================================================
-# 6. PRICE PLOT
+# INPUT
 # =========================================================
-plt.figure(figsize=(15,6))
-x = np.arange(len(session_df))
-plt.bar(x - 0.2, session_df["Price_PT (EUR/MWh)"], width=0.4, label="PT")
-plt.bar(x + 0.2, session_df["Price_ES (EUR/MWh)"], width=0.4, label="ES")
-plt.xticks(x, session_df["PERIOD"], rotation=45)
-plt.ylabel("EUR/MWh")
-plt.title("24h Day-Ahead Market Prices: PT vs ES")
-plt.legend()
-plt.grid(axis="y", linestyle="--", alpha=0.6)
-plt.tight_layout()
-plt.show()
\ No newline at end of file
+def read_bids(file_path):
+    """Read and normalize the bids workbook.
+
+    When pyarrow is available the normalized table is cached next to the
+    workbook as <file_path>.parquet, tagged with the size and mtime of the
+    workbook and INPUT_CACHE_VERSION, and reused while all three match.
+    """
+    stat = os.stat(file_path)
+    source = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "version": INPUT_CACHE_VERSION}
+    cache = f"{file_path}.parquet"
+    if HAS_PYARROW and os.path.exists(cache):
+        try:
+            df = pd.read_parquet(cache)
+        except (OSError, ValueError):  # unreadable cache: rebuild it
+            df = None
+        if df is not None and df.attrs.pop("source", None) == source:
+            return df
+
+    df = pd.read_excel(file_path, engine=EXCEL_ENGINE)
+
+    df.columns = df.columns.str.strip().str.upper()
+    for c in ["TRANSACTION TYPE", "COUNTRY", "TECHNOLOGY", "UNIT", "AGENT"]:
+        if c in df.columns:
+            df[c] = df[c].astype(str).str.strip().str.upper().astype("category")
+
+    if HAS_PYARROW:
+        df.attrs["source"] = source
+        try:
+            df.to_parquet(cache)
+        except OSError:  # the cache is optional, e.g. next to a read-only workbook
+            pass
+        del df.attrs["source"]
+    return df
+
+
+def _category_code(col, value):
+    """Integer code of value in the categorical column col (-2 if absent,
+    so that it never matches a code, not even the -1 of missing values)."""
+    categories = col.cat.categories
+    return categories.get_loc(value) if value in categories else -2
+
+
+def main():
+
+    np.random.seed(42)
+
+    # =========================================================
+    # 1. LOAD DATA
+    # =========================================================
+    file_path = "Input_Exemplo.xlsx"
+    base_name, ext = os.path.splitext(file_path)
+    output_file = f"{base_name}_MarketResults{ext}"
+    df = read_bids(file_path)
+
+    # Alias price + tie-breaker
+    df["BID PRICE (EUR/MWH)"] = df["BID PRICE RANDOM LNEG 2 (EUR/MWH)"]
+    df["BID PRICE (EUR/MWH)"] += 0.001 * np.random.rand(len(df))
+
+    # Role and zone masks, evaluated once for all hours by integer
+    # comparison of the categorical codes
+    type_code = df["TRANSACTION TYPE"].cat.codes.to_numpy()
+    country_code = df["COUNTRY"].cat.codes.to_numpy()
+    df["IS SELL"] = type_code == _category_code(df["TRANSACTION TYPE"], "SELL")
+    df["IS BUY"] = type_code == _category_code(df["TRANSACTION TYPE"], "BUY")
+    df["IS PT"] = country_code == _category_code(df["COUNTRY"], "PT")
+    df["IS ES"] = country_code == _category_code(df["COUNTRY"], "ES")
+
+    # =========================================================
+    # 2. HOURS TO SIMULATE
+    # =========================================================
+    cols_time = ["PERIOD OF YEAR", "YEAR", "MONTH", "DAY", "SESSION", "PERIOD"]
+    hours = (
+        df[cols_time]
+        .apply(pd.to_numeric, errors="coerce")
+        .dropna(subset=["PERIOD"])
+        .drop_duplicates(subset=["PERIOD"])
+        .sort_values("PERIOD")
+        .reset_index(drop=True)
+        .astype(int)
+    )
+
+    # =========================================================
+    # 3. RESULT CONTAINERS
+    # =========================================================
+    # One row per hour / one entry per bid, filled in place by position
+    session_values = np.empty((len(hours), len(SESSION_COLUMNS)))
+    traded_energy = np.zeros(len(df))
+    clearing_price = np.full(len(df), np.nan)
+
+    # =========================================================
+    # 4. HOURLY MARKET CLEARING
+    # =========================================================
+    # Hours are independent: group the bids by period once and clear
+    # them one after the other (the merit-order clearing of an hour takes
+    # well under a millisecond, far less than starting a worker process).
+    # Keyed by the numeric PERIOD, as in hours
+    groups = df.groupby(pd.to_numeric(df["PERIOD"], errors="coerce"), sort=False)
+    df_by_period = {period: df_h for period, df_h in groups}
+    rows_by_period = groups.indices
+
+    # With PyPSA all hours go into one LP, one snapshot per hour.
+    if CLEARING_METHOD == "pypsa":
+        results = clear_day_pypsa(hours, df_by_period)
+    else:
+        results = [
+            clear_hour(h, df_by_period[h["PERIOD"]])
+            for h in hours.to_dict("records")
+        ]
+
+    # Log and store the hours in PERIOD order
+    for i, h in enumerate(hours.to_dict("records")):
+        session, traded, market_price = results[i]
+        _print_hour(h, session, _intercap(df_by_period[h["PERIOD"]]))
+        rows = rows_by_period[h["PERIOD"]]
+        session_values[i] = session
+        traded_energy[rows] = traded
+        clearing_price[rows] = market_price
+
+    # =========================================================
+    # 5. EXPORT RESULTS
+    # =========================================================
+    session_df = pd.concat(
+        [hours, pd.DataFrame(session_values, columns=SESSION_COLUMNS)], axis=1
+    )
+    session_df.insert(len(cols_time), "Bidding Area", "MI")
+    session_df["Congested"] = session_df["Congested"].astype(int)
+
+    rows_by_hour = [rows_by_period[period] for period in hours["PERIOD"]]
+    rows = np.concatenate(rows_by_hour)
+    times = hours.loc[hours.index.repeat([len(r) for r in rows_by_hour]), cols_time]
+    trading_df = _trading_results(df.iloc[rows], times, traded_energy[rows], clearing_price[rows])
+
+    _add_welfare(session_df, trading_df)
+
+    with pd.ExcelWriter(output_file, engine="xlsxwriter") as writer:
+        session_df.to_excel(writer, sheet_name="Session Results", index=False)
+        if TRADING_RESULTS_FORMAT == "excel":
+            trading_df.to_excel(writer, sheet_name="Trading Results Detailed", index=False)
+
+    if TRADING_RESULTS_FORMAT == "parquet":
+        trading_df.to_parquet(f"{base_name}_TradingResults.parquet", compression="snappy", index=False)
+
+    print("\n✔ 24h Day-Ahead MIBEL Simulation Completed Successfully!")
+
+    # =========================================================
+    # 6. PRICE PLOT
+    # =========================================================
+    # Both zones in one grouped bar call
+    ax = session_df.plot.bar(
+        x="PERIOD",
+        y=["Price_PT (EUR/MWh)", "Price_ES (EUR/MWh)"],
+        width=0.8,
+        rot=45,
+        figsize=(15,6)
+    )
+    ax.legend(["PT", "ES"])
+    ax.set_xlabel("")
+    ax.set_ylabel("EUR/MWh")
+    ax.set_title("24h Day-Ahead Market Prices: PT vs ES")
+    ax.grid(axis="y", linestyle="--", alpha=0.6)
+    plt.tight_layout()
+    plt.savefig(f"{base_name}_prices.png", dpi=100, bbox_inches="tight")
+    plt.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Merit-order and PyPSA clearing must agree on small hand-built hours."""
+import importlib.util
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+_spec = importlib.util.spec_from_file_location(
+    "mibel_dam", Path(__file__).resolve().parent.parent / "MIBEL_DAM_v1-2.py"
+)
+mibel = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(mibel)
+
+
+def _hour(bids):
+    """Bids of period 1 as (transaction type, country, price, energy) tuples."""
+    df = pd.DataFrame(
+        bids, columns=["TRANSACTION TYPE", "COUNTRY", "BID PRICE (EUR/MWH)", "BID ENERGY (MWH)"]
+    )
+    df["PERIOD"] = 1
+    df["IS SELL"] = df["TRANSACTION TYPE"] == "SELL"
+    df["IS BUY"] = df["TRANSACTION TYPE"] == "BUY"
+    df["IS PT"] = df["COUNTRY"] == "PT"
+    df["IS ES"] = df["COUNTRY"] == "ES"
+    return df
+
+
+def _clear_both(df_h):
+    h = {"PERIOD": 1}
+    merit = mibel.clear_hour(h, df_h)
+    pypsa = mibel.clear_day_pypsa(pd.DataFrame([h]), {1: df_h})[0]
+    return merit, pypsa
+
+
+def test_marginal_bid_covers_last_fraction_of_demand():
+    df_h = _hour([
+        ("SELL", "PT", 10.0, 100.0),
+        ("SELL", "PT", 50.0, 100.0),
+        ("BUY", "PT", 4000.0, 100.001),
+    ])
+    (session, traded, price), (session_lp, traded_lp, price_lp) = _clear_both(df_h)
+
+    assert session[0] == pytest.approx(50.0)
+    assert session_lp[0] == pytest.approx(50.0)
+    np.testing.assert_allclose(traded, traded_lp, atol=1e-6)
+    np.testing.assert_allclose(price, price_lp)
+
+
+def test_mandatory_shortage_raises_in_both_methods():
+    df_h = _hour([
+        ("SELL", "PT", 10.0, 100.0),
+        ("BUY", "PT", 4000.0, 100.001),
+    ])
+    with pytest.raises(ValueError):
+        mibel.clear_hour({"PERIOD": 1}, df_h)
+    with pytest.raises(ValueError):
+        mibel.clear_day_pypsa(pd.DataFrame([{"PERIOD": 1}]), {1: df_h})